@@ -38,6 +38,7 @@ parser.add_argument('--classification', dest='classification_flag', action='stor
 parser.add_argument('--pretrain_epoch', default=100, type=int, help='total number of pretraining epochs')
 parser.add_argument('--train_epoch', default=1500, type=int, help='total number of training epochs')
 parser.add_argument('--mh_step', default=1, type=int, help='number of SGHMC step for imputation')
+parser.add_argument('--bf16_impute', action='store_true', help='BF16 autocast for the imputation likelihoods on GPU')
 parser.add_argument('--impute_lr', default=[3e-3, 3e-4, 1e-6], type=float, nargs='+', help='step size for SGHMC')
 parser.add_argument('--impute_alpha', default=0.1, type=float, help='momentum weight for SGHMC')
 parser.add_argument('--para_lr_train', default=[1e-3, 1e-5, 1e-7, 1e-12], type=float, nargs='+',
@@ -85,7 +86,8 @@ def main():
     _, _, x_temp = next(iter(train_set))
     net_args = dict(num_hidden=args.layer, hidden_dim=args.unit, input_dim=x_temp.size(dim=0),
                     output_dim=len(data.y.unique()) if classification_flag else 1,
-                    treat_layer=args.depth, treat_node=args.treat_node)
+                    treat_layer=args.depth, treat_node=args.treat_node,
+                    bf16_impute=args.bf16_impute)
 
     # number of independent runs for sparsity
     num_seed = args.num_run
@@ -1,11 +1,69 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import numpy as np
+from functools import partial
+
+
+def _sse(a, b):
+    # sum of squared errors, equivalent to nn.MSELoss(reduction='sum') without the module dispatch
+    return (a - b).pow(2).sum()
+
+
+def _cond_gaussian_loglik(graph_x, x1, graph_mask):
+    """
+    log likelihood of the covariates with missing values under the gaussian graphical model
+    graph_x: tensor of shape (len(miss_col), n, graph size)
+        data subset of each graph, the first column is X1 and the rest columns are X2
+    x1: tensor of shape (len(miss_col), n)
+        the covariates with missing values, gradient flows through this argument only
+    graph_mask: bool tensor of shape (len(miss_col), graph size)
+        False at the padded positions of the graphs
+    output: the log likelihood and the info tensor of the Cholesky factorization
+    """
+    with torch.no_grad():
+        # mean vector μ = [μ1, μ2]
+        graph_mean = graph_x.mean(dim=1, keepdim=True)
+        # centered data, with the padded columns zeroed out
+        graph_xc = (graph_x - graph_mean) * graph_mask.unsqueeze(1)
+        # covariance matrix Σ = [[Σ_11, Σ_12], [Σ_21, Σ_22]]
+        graph_cov = torch.bmm(graph_xc.mT, graph_xc)
+        graph_cov.div_(graph_x.shape[1] - 1)
+        # pad Σ_22 with identity so that every graph in the batch stays positive definite
+        cov_22 = graph_cov[:, 1:, 1:] + torch.diag_embed((~graph_mask[:, 1:]).to(graph_cov.dtype))
+        cov_21 = graph_cov[:, 1:, 0]
+        # regression coefficient of the conditional mean: Σ_22^(-1) Σ_21
+        cov_22_chol, info = torch.linalg.cholesky_ex(cov_22)
+        temp = torch.cholesky_solve(cov_21.unsqueeze(-1), cov_22_chol).squeeze(-1)
+        # conditional mean: μ_{1|2} = μ1 + Σ_12 Σ_22^(-1) (X2 - μ2)
+        cond_mean = graph_mean[:, :, 0] + torch.bmm(graph_xc[:, :, 1:], temp.unsqueeze(-1)).squeeze(-1)
+        # conditional variance: σ²_{1|2} = Σ_11 - Σ_12 Σ_22^(-1) Σ_21
+        cond_cov = graph_cov[:, 0, 0] - (temp * cov_21).sum(dim=-1)
+    # log p(x_1 | X_2) ∝ - (x_1 - μ_{1|2})² / (2 σ²_{1|2})
+    likelihood = -((x1 - cond_mean).pow(2).sum(dim=1) / (2 * cond_cov)).sum()
+    return likelihood, info
+
+
+class TanhLinear(nn.Linear):
+    """
+    linear layer applied to the tanh activation of its input, replacing nn.Sequential(nn.Tanh(), nn.Linear(...)) so
+    that each hidden layer is a single module call
+    """
+    def forward(self, x):
+        return F.linear(torch.tanh(x), self.weight, self.bias)
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # state_dicts saved before TanhLinear store the parameters as '<i>.1.weight' and '<i>.1.bias'
+        for name in ('weight', 'bias'):
+            if prefix + '1.' + name in state_dict and prefix + name not in state_dict:
+                state_dict[prefix + name] = state_dict.pop(prefix + '1.' + name)
+        super(TanhLinear, self)._load_from_state_dict(state_dict, prefix, *args, **kwargs)
 
 
 class StoNet_Causal(nn.Module):
     def __init__(self, num_hidden, hidden_dim, input_dim, output_dim, treat_layer, treat_node,
-                 CE_treat_weight=None, miss_col=None, obs_ind_node=None, miss_pattern=None):
+                 CE_treat_weight=None, miss_col=None, obs_ind_node=None, miss_pattern=None, bf16_impute=False,
+                 compile_miss=False):
         """
         initialize the network
         num_hidden: int
@@ -29,6 +87,12 @@ class StoNet_Causal(nn.Module):
         miss_pattern: str
             "mar": missing at random
             "mnar": missing not at random
+        bf16_impute: bool
+            if True and the network is on GPU, the likelihoods in backward imputation are evaluated under BF16
+            autocast. The hidden units, momentum and noise of SGHMC are kept in FP32
+        compile_miss: bool
+            if True, the conditional gaussian likelihood of the covariates with missing values is compiled by
+            torch.compile (requires torch >= 2.0 and a working Inductor toolchain); otherwise it runs eagerly
         """
         super(StoNet_Causal, self).__init__()
         self.num_hidden = num_hidden
@@ -37,40 +101,68 @@ class StoNet_Causal(nn.Module):
         self.miss_col = miss_col
         self.miss_pattern = miss_pattern
         self.obs_ind_node = obs_ind_node
+        self.bf16_impute = bf16_impute
+        if compile_miss:
+            self.cond_gaussian_loglik = torch.compile(_cond_gaussian_loglik, fullgraph=True, dynamic=True)
+        else:
+            self.cond_gaussian_loglik = _cond_gaussian_loglik
         self.module_list = []
 
         self.module_list.append(nn.Linear(input_dim, hidden_dim[0]))
         self.add_module(str(0), self.module_list[0])
 
         for i in range(self.num_hidden - 1):
-            self.module_list.append(nn.Sequential(nn.Tanh(),
-                                                  nn.Linear(hidden_dim[i], hidden_dim[i + 1])))
+            self.module_list.append(TanhLinear(hidden_dim[i], hidden_dim[i + 1]))
             self.add_module(str(i+1), self.module_list[i+1])
 
-        self.module_list.append(nn.Sequential(nn.Tanh(),
-                                              nn.Linear(hidden_dim[-1], output_dim)))
+        self.module_list.append(TanhLinear(hidden_dim[-1], output_dim))
         self.add_module(str(self.num_hidden), self.module_list[self.num_hidden])
 
+        # hidden nodes of the treatment variables (and of the observed indicators), and the columns of covariates with
+        # missing values, as index tensors so that indexing with them does not copy an index to the device each time
+        self.register_buffer('treat_idx', torch.tensor(np.atleast_1d(self.treat_node), dtype=torch.long),
+                             persistent=False)
+        if self.miss_pattern == 'mnar':
+            self.register_buffer('obs_ind_idx', torch.tensor(np.atleast_1d(self.obs_ind_node), dtype=torch.long),
+                                 persistent=False)
+        if self.miss_col is not None:
+            self.register_buffer('miss_idx', torch.tensor(np.atleast_1d(self.miss_col), dtype=torch.long),
+                                 persistent=False)
+
+        # hidden nodes of the treatment layer (and of the observed indicator layer) other than the treatment (and the
+        # observed indicator) nodes, which are modeled as gaussian in likelihood_latent
+        treat_rest = [i for i in range(hidden_dim[self.treat_layer]) if i not in set(np.atleast_1d(self.treat_node))]
+        self.register_buffer('treat_rest_idx', torch.tensor(treat_rest, dtype=torch.long), persistent=False)
+        if self.miss_pattern == 'mnar':
+            obs_rest = [i for i in range(hidden_dim[self.treat_layer+1])
+                        if i not in set(np.atleast_1d(self.obs_ind_node))]
+            self.register_buffer('obs_rest_idx', torch.tensor(obs_rest, dtype=torch.long), persistent=False)
+
         self.prune_flag = 0
         self.mask_prune = None
+        self.prune_para_list = None
+        self.prune_keep_list = None
 
         # mask to cut the connection from observed indicator to the outcome
         if self.miss_pattern == 'mnar':
-            self.mask_mnar = torch.ones_like(self.module_list[self.treat_layer+2][1].weight)
-            self.mask_mnar[:, self.obs_ind_node] = 0
             self.mnar_masked_para()
 
-        self.sse = nn.MSELoss(reduction='sum')
-
-        if isinstance(self.treat_node, (list, tuple, np.ndarray)):
+        # whether the treatment is multi-class, resolved once so that callers (e.g. training) do not need to check the type
+        self.treat_multi = isinstance(self.treat_node, (list, tuple, np.ndarray))
+        if self.treat_multi:
             self.treat_loss = nn.CrossEntropyLoss(weight=CE_treat_weight, reduction='sum')
+            self.ps_fn = partial(torch.softmax, dim=1)
         else:
             self.treat_loss = nn.BCEWithLogitsLoss(pos_weight=CE_treat_weight, reduction='sum')
+            self.ps_fn = torch.sigmoid
 
         if miss_pattern == 'mnar':
             self.obs_ind_loss = nn.BCEWithLogitsLoss(reduction='sum')
 
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    @property
+    def device(self):
+        # follow the parameters, so that the device stays correct after the network is moved by .to()
+        return next(self.parameters()).device
 
     def forward(self, x, treat):
         if self.prune_flag == 1:
@@ -79,136 +171,121 @@ class StoNet_Causal(nn.Module):
         if self.miss_pattern == 'mnar':
             self.mnar_masked_para()
 
-        for layer_index in range(self.num_hidden+1):
-            x = self.module_list[layer_index](x)
-            if layer_index == self.treat_layer:
-                logits = torch.clone(x[:, self.treat_node])
-                if isinstance(self.treat_node, (list, tuple, np.ndarray)):
-                    ps = torch.softmax(logits, dim=1)
-                else:
-                    ps = torch.sigmoid(logits)
-                x[:, self.treat_node] = treat
+        # layers up to the treatment layer, then the layers after it, with no per-layer branch in between
+        for layer in self.module_list[:self.treat_layer+1]:
+            x = layer(x)
+        ps = self.ps_fn(x[:, self.treat_node])
+        # overwrite the treatment nodes in place. ps is computed before, and sigmoid/softmax save their outputs, so the
+        # logits do not need to be cloned
+        x.index_copy_(1, self.treat_idx, treat.reshape(x.shape[0], -1).to(x.dtype))
+        for layer in self.module_list[self.treat_layer+1:]:
+            x = layer(x)
         return x, ps
 
     def set_prune(self, user_mask):
         self.mask_prune = user_mask
+        # parameters and the 0/1 multipliers that keep their unpruned entries, aligned for the _foreach kernels
+        self.prune_para_list = [para for name, para in self.named_parameters()]
+        self.prune_keep_list = [(~user_mask[name]).to(para.dtype) for name, para in self.named_parameters()]
         self.prune_flag = 1
 
     def cancel_prune(self):
         self.prune_flag = 0
         self.mask_prune = None
+        self.prune_para_list = None
+        self.prune_keep_list = None
 
     def mnar_masked_para(self):
-        self.module_list[self.treat_layer+2][1].weight.data *= self.mask_mnar
+        self.module_list[self.treat_layer+2].weight.data.index_fill_(1, self.obs_ind_idx, 0.0)
 
     def mnar_masked_grad(self):
-        self.module_list[self.treat_layer+2][1].weight.grad *= self.mask_mnar
+        self.module_list[self.treat_layer+2].weight.grad.index_fill_(1, self.obs_ind_idx, 0.0)
 
     def prune_masked_para(self):
-        for name, para in self.named_parameters():
-            para.data[self.mask_prune[name]] = 0
+        torch._foreach_mul_([para.data for para in self.prune_para_list], self.prune_keep_list)
 
     def prune_masked_grad(self):
-        for name, para in self.named_parameters():
-            para.grad[self.mask_prune[name]] = 0
-
-    def likelihood_miss(self, x_impute, graph):
-        likelihoods = []
-        for i in range(len(self.miss_col)):
-            # 
-            with torch.no_grad():
-                # The index set of variables associated with the i-th missing variable, denoted as X2
-                graph_idx = graph[i]
-                # 提取相关变量的数据子集 (graph_x) 
-                graph_x = x_impute[:, graph_idx]
-                # 均值向量 μ = [μ1, μ2]
-                graph_mean = graph_x.mean(dim=0)
-                # 协方差矩阵 Σ = [[Σ_11, Σ_12], [Σ_21, Σ_22]]
-                graph_cov = graph_x.T.cov()
-                # 计算条件均值的回归系数: Σ_22^(-1) Σ_21
-                temp = torch.linalg.solve(graph_cov[1:len(graph_idx), 1:len(graph_idx)], graph_cov[1:len(graph_idx), 0])
-                # 计算条件均值: 
-                # μ_{1|2} = μ1 + Σ_12 Σ_22^(-1) (X2 - μ2)
-                cond_mean = graph_mean[0] + torch.matmul(graph_x[:, 1:len(graph_idx)] -
-                                                         graph_mean[1:len(graph_idx)], temp)
-                # 计算条件方差:
-                # σ²_{1|2} = Σ_11 - Σ_12 Σ_22^(-1) Σ_21
-                cond_cov = graph_cov[0, 0] - torch.matmul(temp, graph_cov[1:len(graph_idx), 0])
-            # 计算对数似然的一部分:
-            # log p(x_1 | X_2) ∝ - (x_1 - μ_{1|2})² / (2 σ²_{1|2})
-            likelihoods.append(-self.sse(x_impute[:, self.miss_col[i]], cond_mean)/(2*cond_cov))
-        likelihood = sum(likelihoods)
-        return likelihood
+        torch._foreach_mul_([para.grad for para in self.prune_para_list], self.prune_keep_list)
+
+    def pad_graph(self, graph):
+        """
+        stack the graphical structure of all covariates with missing values into padded index tensors, so that the
+        conditional gaussian likelihoods can be evaluated in one batch
+        graph: list of lists
+            graph[i][0] is the i-th covariate with missing values, graph[i][1:] are its neighbors
+        output:
+        graph_idx: long tensor of shape (len(miss_col), max graph size)
+            column index of each graph, padded with the covariate with missing values
+        graph_mask: bool tensor of shape (len(miss_col), max graph size)
+            False at the padded positions
+        """
+        size = max(len(nb) for nb in graph)
+        graph_idx = torch.tensor([list(nb) + [nb[0]] * (size - len(nb)) for nb in graph], dtype=torch.long,
+                                 device=self.device)
+        graph_mask = torch.tensor([[True] * len(nb) + [False] * (size - len(nb)) for nb in graph], device=self.device)
+        return graph_idx, graph_mask
+
+    def likelihood_miss(self, x_impute, graph_idx, graph_mask):
+        """
+        output: the log likelihood, and the info tensor of the Cholesky factorization of each graph, which is nonzero
+        when the covariance matrix is not positive definite. The info is returned instead of checked here, so that the
+        caller can check it once without synchronizing the device at every call
+        """
+        # data subsets of shape (len(miss_col), n, graph size), the first column is the i-th missing variable X1, and
+        # the rest columns are the variables associated with it, denoted as X2
+        graph_x = x_impute[:, graph_idx].permute(1, 0, 2)
+        return self.cond_gaussian_loglik(graph_x, x_impute.index_select(1, self.miss_idx).T, graph_mask)
 
-    def likelihood_latent(self, forward_hidden, hidden_list, layer_index, outcome_loss, sigma_list, y,
+    def likelihood_latent(self, forward_hidden, hidden_list, layer_index, outcome_loss, *, inv_2sigma_list, y,
                           treat_loss_weight=1, obs_ind_loss_weight=1):
+        # inv_2sigma_list[i] = 1 / (2 * sigma_list[i]), precomputed by the caller. It is keyword-only so that calls
+        # still passing sigma_list positionally fail instead of silently using the wrong scale
         if layer_index == 0:  # log_likelihood(Y_1|X)
-            likelihood = -self.sse(forward_hidden, hidden_list[layer_index]) / (2 * sigma_list[
-                layer_index])
+            likelihood = -_sse(forward_hidden, hidden_list[layer_index]) * inv_2sigma_list[layer_index]
 
         elif layer_index == self.treat_layer:  # log_likelihood(Y_i, A|Y_{i-1})
             z = self.module_list[layer_index](hidden_list[layer_index - 1])
 
-            z_treat = z[:, self.treat_node]
-            treat = hidden_list[layer_index][:, self.treat_node]
+            z_treat = z.index_select(1, self.treat_idx)
+            treat = hidden_list[layer_index].index_select(1, self.treat_idx)
             likelihood_treat = -self.treat_loss(z_treat, treat) * treat_loss_weight
 
-            if isinstance(self.treat_node, (list, tuple, np.ndarray)):
-                lower = self.treat_node[0]
-                upper = self.treat_node[-1]
-            else:
-                lower = self.treat_node
-                upper = self.treat_node
-
-            z_rest_1 = z[:, 0:lower]
-            temp1 = hidden_list[layer_index][:, 0:lower]
-            likelihood_rest_1 = -self.sse(z_rest_1, temp1)/(2 * sigma_list[layer_index])
+            z_rest = z.index_select(1, self.treat_rest_idx)
+            temp = hidden_list[layer_index].index_select(1, self.treat_rest_idx)
+            likelihood_rest = -_sse(z_rest, temp) * inv_2sigma_list[layer_index]
 
-            z_rest_2 = z[:, upper + 1:]
-            temp2 = hidden_list[layer_index][:, upper + 1:]
-            likelihood_rest_2 = -self.sse(z_rest_2, temp2)/(2 * sigma_list[layer_index])
-
-            likelihood = likelihood_treat + likelihood_rest_1 + likelihood_rest_2
+            likelihood = likelihood_treat + likelihood_rest
 
         elif layer_index == self.num_hidden:  # log_likelihood(Y|Y_h)
-            likelihood = -outcome_loss(self.module_list[layer_index](hidden_list[layer_index - 1]), y) / (
-                    2 * sigma_list[self.num_hidden])
+            likelihood = -outcome_loss(self.module_list[layer_index](hidden_list[layer_index - 1]), y) * \
+                         inv_2sigma_list[self.num_hidden]
 
         else:  # log_likelihood(Y_i|Y_i-1) or log likelihood related to the observed indicator
             if self.miss_pattern == 'mnar':
                 if layer_index == self.treat_layer+1:
                     m = self.module_list[layer_index](hidden_list[layer_index - 1])
 
-                    m_obs = m[:, self.obs_ind_node]
-                    obs = hidden_list[layer_index][:, self.obs_ind_node]
+                    m_obs = m.index_select(1, self.obs_ind_idx)
+                    obs = hidden_list[layer_index].index_select(1, self.obs_ind_idx)
                     likelihood_obs = -self.obs_ind_loss(m_obs, obs) * obs_ind_loss_weight
 
-                    if isinstance(self.obs_ind_node, (list, tuple, np.ndarray)):
-                        lower = self.obs_ind_node[0]
-                        upper = self.obs_ind_node[-1]
-                    else:
-                        lower = self.obs_ind_node
-                        upper = self.obs_ind_node
-
-                    m_rest_1 = m[:, 0:lower]
-                    temp1 = hidden_list[layer_index][:, 0:lower]
-                    likelihood_obs_rest_1 = -self.sse(m_rest_1, temp1)/(2 * sigma_list[layer_index])
-
-                    m_rest_2 = m[:, upper + 1:]
-                    temp2 = hidden_list[layer_index][:, upper + 1:]
-                    likelihood_obs_rest_2 = -self.sse(m_rest_2, temp2)/(2 * sigma_list[layer_index])
+                    m_rest = m.index_select(1, self.obs_rest_idx)
+                    temp = hidden_list[layer_index].index_select(1, self.obs_rest_idx)
+                    likelihood_obs_rest = -_sse(m_rest, temp) * inv_2sigma_list[layer_index]
 
-                    likelihood = likelihood_obs + likelihood_obs_rest_1 + likelihood_obs_rest_2
+                    likelihood = likelihood_obs + likelihood_obs_rest
                 else:
-                    likelihood = -self.sse(self.module_list[layer_index](hidden_list[layer_index - 1]),
-                                       hidden_list[layer_index]) / (2 * sigma_list[layer_index])
+                    likelihood = -_sse(self.module_list[layer_index](hidden_list[layer_index - 1]),
+                                       hidden_list[layer_index]) * inv_2sigma_list[layer_index]
             else:
-                likelihood = -self.sse(self.module_list[layer_index](hidden_list[layer_index - 1]),
-                                       hidden_list[layer_index]) / (2 * sigma_list[layer_index])
+                likelihood = -_sse(self.module_list[layer_index](hidden_list[layer_index - 1]),
+                                   hidden_list[layer_index]) * inv_2sigma_list[layer_index]
         return likelihood
 
-    def backward_imputation(self, mh_step, impute_lrs, alpha, outcome_loss, sigma_list, x, treat, y, treat_loss_weight=1,
-                            obs_ind_loss_weight=1, graph=None, miss_lr=None, miss_ind=None):
+    def backward_imputation(self, mh_step, impute_lrs, alpha, outcome_loss, *, inv_2sigma_list, x, treat, y,
+                            treat_loss_weight=1, obs_ind_loss_weight=1, graph=None, miss_lr=None, miss_ind=None):
+        device = self.device
+
         # initialize momentum term and hidden unit
         hidden_list, momentum_list = [], []
         hidden_list.append(self.module_list[0](x).detach())
@@ -217,10 +294,11 @@ class StoNet_Causal(nn.Module):
             hidden_list.append(self.module_list[layer_index](hidden_list[-1]).detach())
             momentum_list.append(torch.zeros_like(hidden_list[-1]))
             if layer_index == self.treat_layer:
-                hidden_list[-1][:, self.treat_node] = treat
+                hidden_list[-1].index_copy_(1, self.treat_idx, treat.reshape(x.shape[0], -1).to(x.dtype))
         if self.miss_pattern == 'mnar':
             obs_ind = 1 - miss_ind
-            hidden_list[self.treat_layer+1][:, self.obs_ind_node] = obs_ind  # since obs_ind has no connection to later layers
+            # since obs_ind has no connection to later layers
+            hidden_list[self.treat_layer+1].index_copy_(1, self.obs_ind_idx, obs_ind.reshape(x.shape[0], -1).to(x.dtype))
 
         for i in range(self.num_hidden):
             hidden_list[i].requires_grad = True
@@ -229,55 +307,76 @@ class StoNet_Causal(nn.Module):
 
         # initialize momentum term of x imputation
         if self.miss_col is not None:
-            x_miss_momentum = torch.zeros_like(x[:, self.miss_col])
+            x_miss_momentum = torch.zeros_like(x.index_select(1, self.miss_idx))
+            graph_idx, graph_mask = self.pad_graph(graph)
+            # accumulated Cholesky info of likelihood_miss, checked once after all the SGHMC steps
+            chol_info = torch.zeros((), dtype=torch.long, device=device)
+
+        # noise buffers of SGHMC, refilled in place at each step
+        noise_list = [torch.empty_like(hidden) for hidden in hidden_list]
+        if self.miss_col is not None:
+            x_miss_noise = torch.empty_like(x_miss_momentum)
+        sqrt_2alpha = np.sqrt(2 * alpha)
+
+        # BF16 autocast only covers the likelihood evaluations. The SGHMC state stays in FP32, since updates of size
+        # lr * momentum would be rounded away by the 8-bit mantissa of BF16
+        use_bf16 = self.bf16_impute and device.type == 'cuda'
 
         # backward imputation by SGHMC
         for step in range(mh_step):
             # hidden units imputation
             for layer_index in reversed(range(self.num_hidden)):
-                hidden_list[layer_index].grad = None
-
-                hidden_likelihood1 = self.likelihood_latent(forward_hidden, hidden_list, layer_index + 1, outcome_loss, sigma_list,
-                                                            y, treat_loss_weight, obs_ind_loss_weight)
-                hidden_likelihood2 = self.likelihood_latent(forward_hidden, hidden_list, layer_index, outcome_loss, sigma_list,
-                                                            y, treat_loss_weight, obs_ind_loss_weight)
-
-                hidden_likelihood1.backward()
-                hidden_likelihood2.backward()
+                with torch.autocast(device.type, dtype=torch.bfloat16, enabled=use_bf16):
+                    hidden_likelihood1 = self.likelihood_latent(forward_hidden, hidden_list, layer_index + 1,
+                                                                outcome_loss, inv_2sigma_list=inv_2sigma_list, y=y,
+                                                                treat_loss_weight=treat_loss_weight,
+                                                                obs_ind_loss_weight=obs_ind_loss_weight)
+                    hidden_likelihood2 = self.likelihood_latent(forward_hidden, hidden_list, layer_index,
+                                                                outcome_loss, inv_2sigma_list=inv_2sigma_list, y=y,
+                                                                treat_loss_weight=treat_loss_weight,
+                                                                obs_ind_loss_weight=obs_ind_loss_weight)
+
+                # differentiate both terms in one pass, and only w.r.t. the hidden units being imputed
+                hidden_list[layer_index].grad, = torch.autograd.grad(hidden_likelihood1 + hidden_likelihood2,
+                                                                     hidden_list[layer_index])
 
                 lr = impute_lrs[layer_index]
                 with torch.no_grad():
-                    momentum_list[layer_index] = (1 - alpha) * momentum_list[layer_index] + lr * hidden_list[
-                        layer_index].grad + torch.FloatTensor(hidden_list[layer_index].shape).to(self.device).normal_().mul(
-                        np.sqrt(2*alpha))
+                    # momentum = (1 - alpha) * momentum + lr * grad + sqrt(2 * alpha) * noise, updated in place
+                    momentum_list[layer_index].mul_(1 - alpha).add_(hidden_list[layer_index].grad, alpha=lr).add_(
+                        noise_list[layer_index].normal_(), alpha=sqrt_2alpha)
                     if layer_index == self.treat_layer:
                         # treatment node will not be updated
-                        momentum_list[layer_index][:, self.treat_node] = torch.zeros_like(treat)
+                        momentum_list[layer_index].index_fill_(1, self.treat_idx, 0.0)
                     if self.miss_pattern == 'mnar':
                         if layer_index == self.treat_layer+1:
                         # obs_ind node will not be updated
-                            momentum_list[layer_index][:, self.obs_ind_node] = torch.zeros_like(obs_ind)
+                            momentum_list[layer_index].index_fill_(1, self.obs_ind_idx, 0.0)
 
-                    hidden_list[layer_index].data += lr * momentum_list[layer_index]
+                    hidden_list[layer_index].data.add_(momentum_list[layer_index], alpha=lr)
             # missing value imputation
             if self.miss_col is not None:
                 x_impute = torch.clone(x.detach())  # x cannot be treated as leaf variable by pytorch, so create x_impute
                 x_impute.requires_grad = True
-                x_impute.grad = None
 
-                miss_likelihood1 = self.likelihood_miss(x_impute, graph)
-                miss_likelihood2 = -self.sse(self.module_list[0](x_impute), hidden_list[layer_index]) / (2 * sigma_list[0])
+                miss_likelihood1, info = self.likelihood_miss(x_impute, graph_idx, graph_mask)
+                chol_info += info.abs().sum()
+                with torch.autocast(device.type, dtype=torch.bfloat16, enabled=use_bf16):
+                    miss_likelihood2 = -_sse(self.module_list[0](x_impute), hidden_list[layer_index]) * \
+                                       inv_2sigma_list[0]
 
-                miss_likelihood1.backward()
-                miss_likelihood2.backward()
+                x_impute.grad, = torch.autograd.grad(miss_likelihood1 + miss_likelihood2, x_impute)
 
                 with torch.no_grad():
-                    x_miss_momentum = (1 - alpha) * x_miss_momentum + miss_lr * x_impute.grad[:, self.miss_col] + \
-                                      torch.FloatTensor(x_impute[:, self.miss_col].shape).to(self.device).normal_().mul(np.sqrt(2*alpha))
-                    x_miss_momentum = x_miss_momentum * miss_ind # only update the entries with missing values
-                    x[:, self.miss_col] += miss_lr * x_miss_momentum
+                    x_miss_momentum.mul_(1 - alpha).add_(x_impute.grad.index_select(1, self.miss_idx),
+                                                         alpha=miss_lr).add_(x_miss_noise.normal_(), alpha=sqrt_2alpha)
+                    x_miss_momentum.mul_(miss_ind)  # only update the entries with missing values
+                    x.index_add_(1, self.miss_idx, x_miss_momentum, alpha=miss_lr)
 
                     # update the hidden nodes in the first hidden layer after missing value imputation
                     forward_hidden = torch.clone(self.module_list[0](x).detach())
 
+        if self.miss_col is not None and chol_info.item() != 0:
+            raise torch.linalg.LinAlgError("covariance matrix of the graph is not positive definite")
+
         return hidden_list
@@ -130,11 +130,14 @@ def training(mode, net, train_data, val_data, epochs, batch_size, optimizer_list
         out_loss_sum = nn.MSELoss(reduction='sum')
 
     # treatment loss function
-    if isinstance(net.treat_node, (list, tuple, np.ndarray)):
+    if net.treat_multi:
         treat_loss = nn.CrossEntropyLoss()
     else:
         treat_loss = nn.BCELoss()
 
+    # scaling of the gaussian log likelihood of each layer, 1 / (2 * sigma)
+    inv_2sigma_list = [1 / (2 * sigma) for sigma in sigma_list]
+
     # intermediate values for prior gradient calculation
     c1 = np.log(lambda_n) - np.log(1 - lambda_n) + 0.5 * np.log(prior_sigma_0) - 0.5 * np.log(prior_sigma_1)
     c2 = 0.5 / prior_sigma_0 - 0.5 / prior_sigma_1
@@ -167,7 +170,7 @@ def training(mode, net, train_data, val_data, epochs, batch_size, optimizer_list
         # print("miss_lr", miss_lr)
         for y, treat, x, *rest in train_data:
             backward_imputation_args = dict(mh_step=mh_step, impute_lrs=step_impute_lrs, alpha=alpha,
-                                            outcome_loss=out_loss_sum, sigma_list=sigma_list, x=x, treat=treat,
+                                            outcome_loss=out_loss_sum, inv_2sigma_list=inv_2sigma_list, x=x, treat=treat,
                                             y=y, treat_loss_weight=treat_loss_weight, obs_ind_loss_weight=obs_ind_loss_weight)
             if net.miss_col is not None:
                 miss_ind = rest[0]
@@ -188,8 +191,10 @@ def training(mode, net, train_data, val_data, epochs, batch_size, optimizer_list
 
             forward_hidden = net.module_list[0](x)
             for layer_index in range(net.num_hidden + 1):
-                likelihood = net.likelihood_latent(forward_hidden, hidden_list, layer_index, out_loss_sum, sigma_list, y,
-                                                   treat_loss_weight, obs_ind_loss_weight) / batch_size
+                likelihood = net.likelihood_latent(forward_hidden, hidden_list, layer_index, out_loss_sum,
+                                                   inv_2sigma_list=inv_2sigma_list, y=y,
+                                                   treat_loss_weight=treat_loss_weight,
+                                                   obs_ind_loss_weight=obs_ind_loss_weight) / batch_size
                 optimizer = optimizer_list[layer_index]
                 likelihood.backward()
 
@@ -212,8 +217,10 @@ def training(mode, net, train_data, val_data, epochs, batch_size, optimizer_list
                     with torch.no_grad():
                         # need to recalculate likelihood afater the last parameter update
                         # make sure that treat loss have the same weight as outcome loss
-                        likelihood = net.likelihood_latent(forward_hidden, hidden_list, layer_index, out_loss_sum, sigma_list, y,
-                                                           treat_loss_weight, obs_ind_loss_weight)
+                        likelihood = net.likelihood_latent(forward_hidden, hidden_list, layer_index, out_loss_sum,
+                                                           inv_2sigma_list=inv_2sigma_list, y=y,
+                                                           treat_loss_weight=treat_loss_weight,
+                                                           obs_ind_loss_weight=obs_ind_loss_weight)
                         hidden_likelihood[layer_index] += likelihood
         # calculate training performance
         out_train_loss, out_train_correct, treat_train_loss, treat_train_correct = 0, 0, 0, 0
@@ -222,7 +229,7 @@ def training(mode, net, train_data, val_data, epochs, batch_size, optimizer_list
                 pred, ps = net.forward(x, treat)
                 out_train_loss += out_loss(pred, y).item()
                 treat_train_loss += treat_loss(ps, treat).item()  # note that for BCELoss the input has to be probability
-                if isinstance(net.treat_node, (list, tuple, np.ndarray)):
+                if net.treat_multi:
                     treat_train_correct += (ps.argmax(dim=1) == treat.argmax(dim=1)).sum().item()
                 else:
                     treat_train_correct += ((ps > 0.5) == treat).sum().item()
@@ -253,7 +260,7 @@ def training(mode, net, train_data, val_data, epochs, batch_size, optimizer_list
                 pred, ps = net.forward(x, treat)
                 out_val_loss += out_loss(pred, y).item()
                 treat_val_loss += treat_loss(ps, treat).item()
-                if isinstance(net.treat_node, (list, tuple, np.ndarray)):
+                if net.treat_multi:
                     treat_val_correct += (ps.argmax(dim=1) == treat.argmax(dim=1)).sum().item()
                 else:
                     treat_val_correct += ((ps > 0.5) == treat).sum().item()
@@ -303,7 +310,7 @@ def training(mode, net, train_data, val_data, epochs, batch_size, optimizer_list
                         var_ind_treat = np.copy(var_ind_out[net.treat_node, :])
                         # var_ind_out[net.treat_node, :] = np.zeros_like(var_ind_out[net.treat_node, :])
             var_ind_out = np.max(var_ind_out, 0)
-            if isinstance(net.treat_node, (list, tuple, np.ndarray)):
+            if net.treat_multi:
                 var_ind_treat = np.prod(var_ind_treat, axis=0)
             num_selected_out = np.sum(var_ind_out)
             num_selected_treat = np.sum(var_ind_treat)
@@ -38,6 +38,9 @@ parser.add_argument('--classification', dest='classification_flag', action='stor
 parser.add_argument('--pretrain_epoch', default=100, type=int, help='total number of pretraining epochs')
 parser.add_argument('--train_epoch', default=1500, type=int, help='total number of training epochs')
 parser.add_argument('--mh_step', default=1, type=int, help='number of SGHMC step for imputation')
+parser.add_argument('--bf16_impute', action='store_true', help='BF16 autocast for the imputation likelihoods on GPU')
+parser.add_argument('--compile_miss', action='store_true',
+                    help='compile the likelihood of the covariates with missing values by torch.compile')
 parser.add_argument('--impute_lr', default=[3e-3, 1e-4, 1e-6], type=float, nargs='+',
                     help='step size for SGHMC for backward imputation of latent variables')
 parser.add_argument('--impute_lr_miss', default=3e-4, type=float,
@@ -89,7 +92,8 @@ def main():
     net_args = dict(num_hidden=args.layer, hidden_dim=args.unit, input_dim=data.x[0].size(dim=0),
                     output_dim=len(data.y.unique()) if classification_flag else 1,
                     treat_layer=args.depth, treat_node=args.treat_node, miss_col=miss_col,
-                    obs_ind_node=args.obs_ind_node, miss_pattern=miss_pattern)
+                    obs_ind_node=args.obs_ind_node, miss_pattern=miss_pattern,
+                    bf16_impute=args.bf16_impute, compile_miss=args.compile_miss)
 
     # set number of independent runs for sparsity
     num_seed = args.num_run